@@ -686,7 +686,7 @@ class BallotWriteupsTests(TestCase):
             verify_can_see(username, url)
 
 class ApproveBallotTests(TestCase):
-    @mock.patch('ietf.sync.rfceditor.requests.post', autospec=True)
+    @mock.patch('ietf.sync.rfceditor._rfc_session.post', autospec=True)
     def test_approve_ballot(self, mock_urlopen):
         mock_urlopen.return_value.text = b'OK'
         mock_urlopen.return_value.status_code = 200
@@ -1475,7 +1475,7 @@ class SubmitToIesgTests(TestCase):
 
 
 class RequestPublicationTests(TestCase):
-    @mock.patch('ietf.sync.rfceditor.requests.post', autospec=True)
+    @mock.patch('ietf.sync.rfceditor._rfc_session.post', autospec=True)
     def test_request_publication(self, mockobj):
         mockobj.return_value.text = b'OK'
         mockobj.return_value.status_code = 200
@@ -70,18 +70,18 @@ def save_document_in_history(doc):
 
     # copy remaining tricky many to many
     def transfer_fields(obj, HistModel):
-        mfields = get_model_fields_as_dict(item)
+        mfields = get_model_fields_as_dict(obj)
         # map doc -> dochist
         for k, v in mfields.items():
             if v == doc:
                 mfields[k] = dochist
-        HistModel.objects.create(**mfields)
+        return HistModel(**mfields)
 
-    for item in RelatedDocument.objects.filter(source=doc):
-        transfer_fields(item, RelatedDocHistory)
+    RelatedDocHistory.objects.bulk_create(
+        [transfer_fields(item, RelatedDocHistory) for item in RelatedDocument.objects.filter(source=doc)])
 
-    for item in DocumentAuthor.objects.filter(document=doc):
-        transfer_fields(item, DocHistoryAuthor)
+    DocHistoryAuthor.objects.bulk_create(
+        [transfer_fields(item, DocHistoryAuthor) for item in DocumentAuthor.objects.filter(document=doc)])
                 
     return dochist
 
@@ -2,20 +2,25 @@
 # -*- coding: utf-8 -*-
 
 
-import base64
+import calendar
 import datetime
+import http.cookiejar
 import re
 import requests
 
-from urllib.parse import urlencode
-from xml.dom import pulldom, Node
+from typing import List, NamedTuple, Optional      # pyflakes:ignore
+
+from lxml import etree
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Prefetch, Q
 from django.utils import timezone
-from django.utils.encoding import smart_bytes, force_str, force_text
+from django.utils.encoding import force_text
 
 import debug                            # pyflakes:ignore
 
+from ietf.api.serializer import model_top_level_cache_key
 from ietf.doc.models import ( Document, DocAlias, State, StateType, DocEvent, DocRelationshipName,
     DocTagName, DocTypeName, RelatedDocument )
 from ietf.doc.expire import move_draft_files_to_archive
@@ -35,37 +40,60 @@ MIN_ERRATA_RESULTS = 5000
 MIN_INDEX_RESULTS = 8000
 MIN_QUEUE_RESULTS = 10
 
+DRAFT_SUFFIX_RE = re.compile(r"(-\d\d)?(\.txt){1,2}$")
+DRAFT_REV_RE = re.compile(r"-\d\d$")
+MISSREF_GENERATION_RE = re.compile(r"\(([0-9]+)G\)")
+AUTH48_BOLD_RE = re.compile(r"(<b>.*</b>)")
+
+MONTH_BY_NAME = dict((name, i + 1) for i, name in enumerate(["January", "February", "March", "April", "May", "June", "July",
+                                                             "August", "September", "October", "November", "December"]))
+
 def get_child_text(parent_node, tag_name):
     text = []
-    for node in parent_node.childNodes:
-        if node.nodeType == Node.ELEMENT_NODE and node.localName == tag_name:
-            text.append(node.firstChild.data)
+    for node in parent_node.iterchildren("{*}%s" % tag_name):
+        text.append(node.text or "")
     return '\n\n'.join(text)
 
 
+def free_element(element):
+    """Release an element which has been fully processed during an
+    iterparse, together with any already processed preceding siblings,
+    so memory use stays bounded by the size of a single entry."""
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
 def parse_queue(response):
-    """Parse RFC Editor queue XML into a bunch of tuples + warnings."""
+    """Parse RFC Editor queue XML into a bunch of tuples + warnings.
+
+    The XML is read incrementally from response, a binary file-like
+    object such as the raw stream of a requests response."""
 
-    events = pulldom.parse(response)
     drafts = []
     warnings = []
     stream = None
 
-    for event, node in events:
+    for event, node in etree.iterparse(response, events=("start", "end"), tag=("{*}section", "{*}entry")):
         try:
-            if event == pulldom.START_ELEMENT and node.tagName == "entry":
-                events.expandNode(node)
-                node.normalize()
+            tag = etree.QName(node).localname
+            if event == "end" and tag == "entry":
                 draft_name = get_child_text(node, "draft").strip()
-                draft_name = re.sub(r"(-\d\d)?(.txt){1,2}$", "", draft_name)
+                draft_name = DRAFT_SUFFIX_RE.sub("", draft_name)
                 date_received = get_child_text(node, "date-received")
 
                 state = ""
                 tags = []
                 missref_generation = ""
-                for child in node.childNodes:
-                    if child.nodeType == Node.ELEMENT_NODE and child.localName == "state":
-                        state = child.firstChild.data
+                auth48 = ""
+                cluster = ""
+                refs = []
+                for child in node.iterchildren("{*}state", "{*}auth48-url", "{*}cluster-url", "{*}normRef"):
+                    child_tag = etree.QName(child).localname
+                    if child_tag == "state":
+                        state = child.text or ""
                         # state has some extra annotations encoded, parse
                         # them out
                         if '*R' in state:
@@ -74,35 +102,30 @@ def parse_queue(response):
                         if '*A' in state:
                             tags.append("iana")
                             state = state.replace("*A", "")
-                        m = re.search(r"\(([0-9]+)G\)", state)
+                        m = MISSREF_GENERATION_RE.search(state)
                         if m:
                             missref_generation = m.group(1)
                             state = state.replace("(%sG)" % missref_generation, "")
 
-                # AUTH48 link
-                auth48 = ""
-                for child in node.childNodes:
-                    if child.nodeType == Node.ELEMENT_NODE and child.localName == "auth48-url":
-                        auth48 = child.firstChild.data
+                    elif child_tag == "auth48-url":
+                        # AUTH48 link
+                        auth48 = child.text or ""
 
-                # cluster link (if it ever gets implemented)
-                cluster = ""
-                for child in node.childNodes:
-                    if child.nodeType == Node.ELEMENT_NODE and child.localName == "cluster-url":
-                        cluster = child.firstChild.data
+                    elif child_tag == "cluster-url":
+                        # cluster link (if it ever gets implemented)
+                        cluster = child.text or ""
 
-                refs = []
-                for child in node.childNodes:
-                    if child.nodeType == Node.ELEMENT_NODE and child.localName == "normRef":
+                    elif child_tag == "normRef":
                         ref_name = get_child_text(child, "ref-name")
                         ref_state = get_child_text(child, "ref-state")
                         in_queue = ref_state.startswith("IN-QUEUE")
                         refs.append((ref_name, ref_state, in_queue))
 
                 drafts.append((draft_name, date_received, state, tags, missref_generation, stream, auth48, cluster, refs))
+                free_element(node)
 
-            elif event == pulldom.START_ELEMENT and node.tagName == "section":
-                name = node.getAttribute('name')
+            elif event == "start" and tag == "section":
+                name = node.get('name', '')
                 if name.startswith("IETF"):
                     stream = "ietf"
                 elif name.startswith("IAB"):
@@ -125,9 +148,10 @@ def update_drafts_from_queue(drafts):
     """Given a list of parsed drafts from the RFC Editor queue, update the
     documents in the database. Return those that were changed."""
 
+    tagname_by_slug = dict((t.slug, t) for t in DocTagName.objects.filter(slug__in=['iana', 'ref']))
     tag_mapping = {
-        'IANA': DocTagName.objects.get(slug='iana'),
-        'REF':  DocTagName.objects.get(slug='ref')
+        'IANA': tagname_by_slug['iana'],
+        'REF':  tagname_by_slug['ref']
     }
 
     slookup = dict((s.slug, s)
@@ -148,6 +172,9 @@ def update_drafts_from_queue(drafts):
         'MISSREF': slookup['missref'],
     }
 
+    prev_iesg_state = State.objects.get(used=True, type="draft-iesg", slug="ann")
+    next_iesg_state = State.objects.get(used=True, type="draft-iesg", slug="rfcqueue")
+
     system = Person.objects.get(name="(System)")
 
     warnings = []
@@ -155,7 +182,15 @@ def update_drafts_from_queue(drafts):
     names = [t[0] for t in drafts]
 
     drafts_in_db = dict((d.name, d)
-                        for d in Document.objects.filter(type="draft", docalias__name__in=names))
+                        for d in Document.objects.filter(type="draft", docalias__name__in=names).prefetch_related(
+                            Prefetch("states", queryset=State.objects.select_related("type")),
+                            "tags",
+                        ))
+
+    received_announcement = set(DocEvent.objects.filter(
+        doc__in=list(drafts_in_db.values()),
+        type="rfc_editor_received_announcement",
+    ).values_list("doc_id", flat=True))
 
     changed = set()
 
@@ -175,7 +210,7 @@ def update_drafts_from_queue(drafts):
         events = []
 
         # check if we've noted it's been received
-        if d.get_state_slug("draft-iesg") == "ann" and not prev_state and not d.latest_event(DocEvent, type="rfc_editor_received_announcement"):
+        if d.get_state_slug("draft-iesg") == "ann" and not prev_state and d.pk not in received_announcement:
             e = DocEvent(doc=d, rev=d.rev, by=system, type="rfc_editor_received_announcement")
             e.desc = "Announcement was received by RFC Editor"
             e.save()
@@ -183,9 +218,6 @@ def update_drafts_from_queue(drafts):
                            '%s in RFC Editor queue' % d.name,
                            'The announcement for %s has been received by the RFC Editor.' % d.name)
             # change draft-iesg state to RFC Ed Queue
-            prev_iesg_state = State.objects.get(used=True, type="draft-iesg", slug="ann")
-            next_iesg_state = State.objects.get(used=True, type="draft-iesg", slug="rfcqueue")
-
             d.set_state(next_iesg_state)
             e = add_state_change_event(d, system, prev_iesg_state, next_iesg_state)
             if e:
@@ -202,7 +234,7 @@ def update_drafts_from_queue(drafts):
             e = add_state_change_event(d, system, prev_state, next_state)
 
             if auth48:
-                e.desc = re.sub(r"(<b>.*</b>)", "<a href=\"%s\">\\1</a>" % auth48, e.desc)
+                e.desc = AUTH48_BOLD_RE.sub("<a href=\"%s\">\\1</a>" % auth48, e.desc)
                 e.save()
                 # Create or update the auth48 URL whether or not this is a state expected to have one.
                 d.documenturl_set.update_or_create(
@@ -217,10 +249,15 @@ def update_drafts_from_queue(drafts):
 
             changed.add(name)
 
-        t = DocTagName.objects.filter(slug__in=tags)
-        if set(t) != set(d.tags.all()):
-            d.tags.clear()
-            d.tags.set(t)
+        current_tags = frozenset(t.slug for t in d.tags.all())
+        wanted_tags = frozenset(slug for slug in tags if slug in tagname_by_slug)
+        if current_tags != wanted_tags:
+            removed = [t for t in d.tags.all() if t.slug not in wanted_tags]
+            added = [tagname_by_slug[slug] for slug in wanted_tags - current_tags]
+            if removed:
+                d.tags.remove(*removed)
+            if added:
+                d.tags.add(*added)
             changed.add(name)
 
         if events:
@@ -228,18 +265,50 @@ def update_drafts_from_queue(drafts):
 
 
     # remove tags and states for those not in the queue anymore
-    for d in Document.objects.exclude(docalias__name__in=names).filter(states__type="draft-rfceditor").distinct():
-        d.tags.remove(*list(tag_mapping.values()))
-        d.unset_state("draft-rfceditor")
+    not_in_queue = dict(Document.objects.exclude(docalias__name__in=names).filter(
+        states__type="draft-rfceditor").distinct().values_list("pk", "name"))
+    if not_in_queue:
+        Document.tags.through.objects.filter(
+            document__in=list(not_in_queue), doctagname__in=list(tag_mapping.values())).delete()
+        Document.states.through.objects.filter(
+            document__in=list(not_in_queue), state__type="draft-rfceditor").delete()
+        # deleting the through rows directly sends no m2m_changed, so
+        # purge the cached API data like its handler would
+        cache.delete_many([model_top_level_cache_key(m) for m in (
+            Document, DocTagName, State, Document.tags.through, Document.states.through)])
         # we do not add a history entry here - most likely we already
         # have something that explains what happened
-        changed.add(name)
+        changed.update(not_in_queue.values())
 
     return changed, warnings
 
 
+class RfcIndexRow(NamedTuple):
+    """One rfc-entry from the RFC Editor index, as returned by parse_index()."""
+    rfc_number: int
+    title: str
+    authors: List[str]
+    rfc_published_date: datetime.date
+    current_status: str
+    updates: List[str]
+    updated_by: List[str]
+    obsoletes: List[str]
+    obsoleted_by: List[str]
+    also: List[str]
+    draft: Optional[str]
+    has_errata: int
+    stream: str
+    wg: Optional[str]
+    file_formats: str
+    pages: str
+    abstract: str
+
+
 def parse_index(response):
-    """Parse RFC Editor index XML into a bunch of tuples."""
+    """Parse RFC Editor index XML into a list of RfcIndexRow tuples.
+
+    The XML is read incrementally from response, a binary file-like
+    object such as the raw stream of a requests response."""
 
     def normalize_std_name(std_name):
         # remove zero padding
@@ -253,41 +322,34 @@ def parse_index(response):
 
     def extract_doc_list(parentNode, tagName):
         l = []
-        for u in parentNode.getElementsByTagName(tagName):
-            for d in u.getElementsByTagName("doc-id"):
-                l.append(normalize_std_name(d.firstChild.data))
+        for u in parentNode.iterchildren("{*}%s" % tagName):
+            for d in u.iterchildren("{*}doc-id"):
+                l.append(normalize_std_name(d.text))
         return l
 
-    also_list = {}
+    also_by_rfc_number = {}
     data = []
-    events = pulldom.parse(response)
-    for event, node in events:
+    for event, node in etree.iterparse(response, events=("end",), tag=("{*}rfc-entry", "{*}bcp-entry", "{*}fyi-entry", "{*}std-entry")):
         try:
-            if event == pulldom.START_ELEMENT and node.tagName in ["bcp-entry", "fyi-entry", "std-entry"]:
-                events.expandNode(node)
-                node.normalize()
+            tag = etree.QName(node).localname
+            if tag in ["bcp-entry", "fyi-entry", "std-entry"]:
                 bcpid = normalize_std_name(get_child_text(node, "doc-id"))
                 doclist = extract_doc_list(node, "is-also")
                 for docid in doclist:
-                    if docid in also_list:
-                        also_list[docid].append(bcpid)
-                    else:
-                        also_list[docid] = [bcpid]
-
-            elif event == pulldom.START_ELEMENT and node.tagName == "rfc-entry":
-                events.expandNode(node)
-                node.normalize()
+                    if docid.startswith("RFC") and docid[3:].isdigit():
+                        also_by_rfc_number.setdefault(int(docid[3:]), []).append(bcpid)
+
+            elif tag == "rfc-entry":
                 rfc_number = int(get_child_text(node, "doc-id")[3:])
                 title = get_child_text(node, "title")
 
                 authors = []
-                for author in node.getElementsByTagName("author"):
+                for author in node.iterchildren("{*}author"):
                     authors.append(get_child_text(author, "name"))
 
-                d = node.getElementsByTagName("date")[0]
+                d = node.find("{*}date")
                 year = int(get_child_text(d, "year"))
-                month = get_child_text(d, "month")
-                month = ["January","February","March","April","May","June","July","August","September","October","November","December"].index(month)+1
+                month = MONTH_BY_NAME[get_child_text(d, "month")]
                 rfc_published_date = datetime.date(year, month, 1)
 
                 current_status = get_child_text(node, "current-status").title()
@@ -303,32 +365,32 @@ def parse_index(response):
                     wg = None
 
                 l = []
-                for fmt in node.getElementsByTagName("format"):
+                for fmt in node.iterchildren("{*}format"):
                     l.append(get_child_text(fmt, "file-format"))
                 file_formats = (",".join(l)).lower()
 
                 abstract = ""
-                for abstract in node.getElementsByTagName("abstract"):
+                for abstract in node.iterchildren("{*}abstract"):
                     abstract = get_child_text(abstract, "p")
 
                 draft = get_child_text(node, "draft")
-                if draft and re.search(r"-\d\d$", draft):
+                if draft and DRAFT_REV_RE.search(draft):
                     draft = draft[0:-3]
 
-                if len(node.getElementsByTagName("errata-url")) > 0:
+                if node.find("{*}errata-url") is not None:
                     has_errata = 1
                 else:
                     has_errata = 0
 
-                data.append((rfc_number,title,authors,rfc_published_date,current_status,updates,updated_by,obsoletes,obsoleted_by,[],draft,has_errata,stream,wg,file_formats,pages,abstract))
+                data.append(RfcIndexRow(rfc_number, title, authors, rfc_published_date, current_status, updates, updated_by, obsoletes, obsoleted_by, [], draft, has_errata, stream, wg, file_formats, pages, abstract))
+
+            free_element(node)
         except Exception as e:
             log("Exception when processing an RFC index entry: %s" % e)
             log("node: %s" % node)
             raise
-    for d in data:
-        k = "RFC%04d" % d[0]
-        if k in also_list:
-            d[9].extend(also_list[k])
+    for row in data:
+        row.also.extend(also_by_rfc_number.get(row.rfc_number, []))
     return data
 
 
@@ -340,12 +402,18 @@ def update_docs_from_rfc_index(index_data, errata_data, skip_older_than_date=Non
     The skip_older_than_date is a bare date, not a datetime.
     """
 
-    errata = {}
+    if skip_older_than_date:
+        # speed up the process by skipping old entries before looking
+        # anything up for them
+        index_data = [row for row in index_data if row.rfc_published_date >= skip_older_than_date]
+
+    # summarize the errata for each RFC as (all rejected, any verified)
+    errata_summary = {}
     for item in errata_data:
-        name = item['doc-id']
-        if not name in errata:
-            errata[name] = []
-        errata[name].append(item)
+        summary = errata_summary.setdefault(item['doc-id'], [True, False])
+        status = item['errata_status_code']
+        summary[0] = summary[0] and status == 'Rejected'
+        summary[1] = summary[1] or status == 'Verified'
 
     std_level_mapping = {
         "Standard": StdLevelName.objects.get(slug="std"),
@@ -372,14 +440,78 @@ def update_docs_from_rfc_index(index_data, errata_data, skip_older_than_date=Non
     relationship_obsoletes = DocRelationshipName.objects.get(slug="obs")
     relationship_updates = DocRelationshipName.objects.get(slug="updates")
 
+    state_rfc = State.objects.get(used=True, type="draft", slug="rfc")
+    state_idexists = State.objects.get(type_id='draft-iesg', slug='idexists')
+    pub_state_types = ("draft-iesg", "draft-stream-iab", "draft-stream-irtf", "draft-stream-ise")
+    state_pub_by_type = dict((s.type_id, s) for s in State.objects.select_related("type").filter(
+        used=True, type__in=pub_state_types, slug="pub"))
+
     system = Person.objects.get(name="(System)")
 
-    for rfc_number, title, authors, rfc_published_date, current_status, updates, updated_by, obsoletes, obsoleted_by, also, draft, has_errata, stream, wg, file_formats, pages, abstract in index_data:
+    group_by_acronym = dict((g.acronym, g) for g in Group.objects.filter(
+        acronym__in=set(row.wg for row in index_data if row.wg)))
+    individ_group = Group.objects.get(type="individ")
+
+    # look up the documents, aliases and events we need in bulk up
+    # front rather than querying for each entry in the index
+    rfc_names = ["rfc%s" % row.rfc_number for row in index_data]
+    draft_names = [row.draft for row in index_data if row.draft]
+    relation_names = set(x.lower() for row in index_data for x in row.updates + row.obsoletes)
+
+    doc_ids_by_alias = {}
+    for alias_name, doc_id in DocAlias.docs.through.objects.filter(
+            docalias__name__in=rfc_names).order_by("document_id").values_list("docalias__name", "document_id"):
+        doc_ids_by_alias.setdefault(alias_name, doc_id)
+
+    docs_by_pk = dict((d.pk, d) for d in Document.objects.filter(
+        Q(pk__in=set(doc_ids_by_alias.values())) | Q(name__in=draft_names)
+    ).select_related("std_level", "stream", "group").prefetch_related(
+        Prefetch("states", queryset=State.objects.select_related("type")),
+        "tags",
+    ))
+    docs_by_name = dict((d.name, d) for d in docs_by_pk.values())
+
+    published_rfc_doc_ids = set(DocEvent.objects.filter(
+        doc__in=list(docs_by_pk), type="published_rfc").values_list("doc_id", flat=True))
+
+    aliases_by_name = dict((a.name, a) for a in DocAlias.objects.filter(name__in=relation_names))
+
+    existing_relations = set(RelatedDocument.objects.filter(
+        source__in=list(docs_by_pk), relationship__in=[relationship_obsoletes, relationship_updates]
+    ).values_list("source_id", "target_id", "relationship_id"))
+
+    also_names = set(a.lower() for row in index_data for a in row.also)
+    existing_also_names = set(DocAlias.objects.filter(name__in=also_names).values_list("name", flat=True))
+
+    # relations to legacy (NIC, IEN, STD, RTR) names are translated to
+    # the RFCs sharing a document with them, where there are any
+    legacy_relation_names = set(x for x in relation_names if x[:3] in ("nic", "ien", "std", "rtr"))
+    rfc_aliases_by_legacy_name = {}
+    for a in DocAlias.objects.filter(
+            name__startswith="rfc", docs__docalias__name__in=legacy_relation_names
+    ).annotate(legacy_name=F("docs__docalias__name")):
+        rfc_aliases_by_legacy_name.setdefault(a.legacy_name, []).append(a)
+
+    def parse_relation_list(l):
+        res = []
+        seen = set()
+        for x in l:
+            if x[:3] in ("NIC", "IEN", "STD", "RTR"):
+                # try translating this to RFCs that we can handle
+                # sensibly; otherwise we'll have to ignore them
+                targets = rfc_aliases_by_legacy_name.get(x.lower(), [])
+            elif x.lower() in aliases_by_name:
+                targets = [aliases_by_name[x.lower()]]
+            else:
+                targets = []
 
-        if skip_older_than_date and rfc_published_date < skip_older_than_date:
-            # speed up the process by skipping old entries
-            continue
+            for a in targets:
+                if a.pk not in seen:
+                    seen.add(a.pk)
+                    res.append(a)
+        return res
 
+    for row in index_data:
         # we assume two things can happen: we get a new RFC, or an
         # attribute has been updated at the RFC Editor (RFC Editor
         # attributes take precedence over our local attributes)
@@ -389,16 +521,12 @@ def update_docs_from_rfc_index(index_data, errata_data, skip_older_than_date=Non
 
         # make sure we got the document and alias
         doc = None
-        name = "rfc%s" % rfc_number
-        a = DocAlias.objects.filter(name=name)
-        if a:
-            doc = a[0].document
+        name = "rfc%s" % row.rfc_number
+        if name in doc_ids_by_alias:
+            doc = docs_by_pk[doc_ids_by_alias[name]]
         else:
-            if draft:
-                try:
-                    doc = Document.objects.get(name=draft)
-                except Document.DoesNotExist:
-                    pass
+            if row.draft:
+                doc = docs_by_name.get(row.draft)
 
             if not doc:
                 changes.append("created document %s" % prettify_std_name(name))
@@ -407,42 +535,43 @@ def update_docs_from_rfc_index(index_data, errata_data, skip_older_than_date=Non
             # add alias
             alias, __ = DocAlias.objects.get_or_create(name=name)
             alias.docs.add(doc)
+            aliases_by_name[name] = alias
             changes.append("created alias %s" % prettify_std_name(name))
 
         # check attributes
-        if title != doc.title:
-            doc.title = title
+        if row.title != doc.title:
+            doc.title = row.title
             changes.append("changed title to '%s'" % doc.title)
 
-        if abstract and abstract != doc.abstract:
-            doc.abstract = abstract
+        if row.abstract and row.abstract != doc.abstract:
+            doc.abstract = row.abstract
             changes.append("changed abstract to '%s'" % doc.abstract)
 
-        if pages and int(pages) != doc.pages:
-            doc.pages = int(pages)
+        if row.pages and int(row.pages) != doc.pages:
+            doc.pages = int(row.pages)
             changes.append("changed pages to %s" % doc.pages)
 
-        if std_level_mapping[current_status] != doc.std_level:
-            doc.std_level = std_level_mapping[current_status]
+        if std_level_mapping[row.current_status] != doc.std_level:
+            doc.std_level = std_level_mapping[row.current_status]
             changes.append("changed standardization level to %s" % doc.std_level)
 
         if doc.get_state_slug() != "rfc":
-            doc.set_state(State.objects.get(used=True, type="draft", slug="rfc"))
+            doc.set_state(state_rfc)
             move_draft_files_to_archive(doc, doc.rev)
             changes.append("changed state to %s" % doc.get_state())
 
-        if doc.stream != stream_mapping[stream]:
-            doc.stream = stream_mapping[stream]
+        if doc.stream != stream_mapping[row.stream]:
+            doc.stream = stream_mapping[row.stream]
             changes.append("changed stream to %s" % doc.stream)
 
         if not doc.group: # if we have no group assigned, check if RFC Editor has a suggestion
-            if wg:
-                doc.group = Group.objects.get(acronym=wg)
+            if row.wg:
+                doc.group = group_by_acronym.get(row.wg) or Group.objects.get(acronym=row.wg)
                 changes.append("set group to %s" % doc.group)
             else:
-                doc.group = Group.objects.get(type="individ") # fallback for newly created doc
+                doc.group = individ_group # fallback for newly created doc
 
-        if not doc.latest_event(type="published_rfc"):
+        if doc.pk not in published_rfc_doc_ids:
             e = DocEvent(doc=doc, rev=doc.rev, type="published_rfc")
             # unfortunately, rfc_published_date doesn't include the correct day
             # at the moment because the data only has month/year, so
@@ -455,88 +584,99 @@ def update_docs_from_rfc_index(index_data, errata_data, skip_older_than_date=Non
             # matched the publication date in PST8PDT. When interpreting the event timestamp
             # as a publication date, you must treat it in the PST8PDT time zone. The
             # RPC_TZINFO constant in ietf.utils.timezone is defined for this purpose.
-            d = datetime_from_date(rfc_published_date, RPC_TZINFO)
+            d = datetime_from_date(row.rfc_published_date, RPC_TZINFO)
             synthesized = timezone.now().astimezone(RPC_TZINFO)
             if abs(d - synthesized) > datetime.timedelta(days=60):
                 synthesized = d
-            else:
-                direction = -1 if (d - synthesized).total_seconds() < 0 else +1
-                while synthesized.month != d.month or synthesized.year != d.year:
-                    synthesized += datetime.timedelta(days=direction)
+            elif (synthesized.year, synthesized.month) > (d.year, d.month):
+                # move back to the last day of the publication month
+                last_day = calendar.monthrange(d.year, d.month)[1]
+                synthesized = synthesized.replace(year=d.year, month=d.month, day=last_day)
+            elif (synthesized.year, synthesized.month) < (d.year, d.month):
+                # move forward to the first day of the publication month
+                synthesized = synthesized.replace(year=d.year, month=d.month, day=1)
             e.time = synthesized
             e.by = system
             e.desc = "RFC published"
             e.save()
             events.append(e)
+            published_rfc_doc_ids.add(doc.pk)
 
             changes.append("added RFC published event at %s" % e.time.strftime("%Y-%m-%d"))
             rfc_published = True
 
-        for t in ("draft-iesg", "draft-stream-iab", "draft-stream-irtf", "draft-stream-ise"):
+        for t in pub_state_types:
             prev_state = doc.get_state(t)
             if prev_state is not None:
                 if prev_state.slug not in ("pub", "idexists"):
-                    new_state = State.objects.select_related("type").get(used=True, type=t, slug="pub")
+                    new_state = state_pub_by_type[t]
                     doc.set_state(new_state)
                     changes.append("changed %s to %s" % (new_state.type.label, new_state))
                     e = update_action_holders(doc, prev_state, new_state)
                     if e:
                         events.append(e)
             elif t == 'draft-iesg':
-                doc.set_state(State.objects.get(type_id='draft-iesg', slug='idexists'))
-
-        def parse_relation_list(l):
-            res = []
-            for x in l:
-                if x[:3] in ("NIC", "IEN", "STD", "RTR"):
-                    # try translating this to RFCs that we can handle
-                    # sensibly; otherwise we'll have to ignore them
-                    l = DocAlias.objects.filter(name__startswith="rfc", docs__docalias__name=x.lower())
-                else:
-                    l = DocAlias.objects.filter(name=x.lower())
-
-                for a in l:
-                    if a not in res:
-                        res.append(a)
-            return res
-
-        for x in parse_relation_list(obsoletes):
-            if not RelatedDocument.objects.filter(source=doc, target=x, relationship=relationship_obsoletes):
-                r = RelatedDocument.objects.create(source=doc, target=x, relationship=relationship_obsoletes)
-                changes.append("created %s relation between %s and %s" % (r.relationship.name.lower(), prettify_std_name(r.source.name), prettify_std_name(r.target.name)))
-
-        for x in parse_relation_list(updates):
-            if not RelatedDocument.objects.filter(source=doc, target=x, relationship=relationship_updates):
-                r = RelatedDocument.objects.create(source=doc, target=x, relationship=relationship_updates)
-                changes.append("created %s relation between %s and %s" % (r.relationship.name.lower(), prettify_std_name(r.source.name), prettify_std_name(r.target.name)))
-
-        if also:
-            for a in also:
+                doc.set_state(state_idexists)
+
+        # relations are part of the snapshot taken by save_with_history()
+        # below, so create them for this entry right away
+        new_relations = []
+        for relationship, l in ((relationship_obsoletes, row.obsoletes), (relationship_updates, row.updates)):
+            for x in parse_relation_list(l):
+                if (doc.pk, x.pk, relationship.pk) not in existing_relations:
+                    existing_relations.add((doc.pk, x.pk, relationship.pk))
+                    new_relations.append(RelatedDocument(source=doc, target=x, relationship=relationship))
+                    changes.append("created %s relation between %s and %s" % (relationship.name.lower(), prettify_std_name(doc.name), prettify_std_name(x.name)))
+        if new_relations:
+            RelatedDocument.objects.bulk_create(new_relations)
+
+        if row.also:
+            new_also_names = []
+            for a in row.also:
                 a = a.lower()
-                if not DocAlias.objects.filter(name=a):
-                    DocAlias.objects.create(name=a).docs.add(doc)
+                if a not in existing_also_names:
+                    existing_also_names.add(a)
+                    new_also_names.append(a)
+                    if a in legacy_relation_names:
+                        rfc_aliases_by_legacy_name[a] = list(DocAlias.objects.filter(name__startswith="rfc", docs=doc))
                     changes.append("created alias %s" % prettify_std_name(a))
-
-        doc_errata = errata.get('RFC%04d'%rfc_number, [])
-        all_rejected = doc_errata and all( er['errata_status_code']=='Rejected' for er in doc_errata )
-        if has_errata and not all_rejected:
-            if not doc.tags.filter(pk=tag_has_errata.pk).exists():
-                doc.tags.add(tag_has_errata)
+            if new_also_names:
+                # create the aliases right away, so later entries in the
+                # index can relate to them
+                DocAlias.objects.bulk_create([DocAlias(name=a) for a in new_also_names])
+                new_aliases = list(DocAlias.objects.filter(name__in=new_also_names))
+                DocAlias.docs.through.objects.bulk_create([
+                    DocAlias.docs.through(docalias_id=alias.pk, document_id=doc.pk) for alias in new_aliases
+                ])
+                for alias in new_aliases:
+                    aliases_by_name[alias.name] = alias
+
+        all_rejected, has_verified_errata = errata_summary.get('RFC%04d'%row.rfc_number, (False, False))
+        current_tags = set(t.pk for t in doc.tags.all())
+        tags_to_add = []
+        tags_to_remove = []
+        if row.has_errata and not all_rejected:
+            if tag_has_errata.pk not in current_tags:
+                tags_to_add.append(tag_has_errata)
                 changes.append("added Errata tag")
-            has_verified_errata = any([ er['errata_status_code']=='Verified' for er in doc_errata ])
-            if has_verified_errata and not doc.tags.filter(pk=tag_has_verified_errata.pk).exists():
-                doc.tags.add(tag_has_verified_errata)
+            if has_verified_errata and tag_has_verified_errata.pk not in current_tags:
+                tags_to_add.append(tag_has_verified_errata)
                 changes.append("added Verified Errata tag")
         else:
-            if doc.tags.filter(pk=tag_has_errata.pk):
-                doc.tags.remove(tag_has_errata)
+            if tag_has_errata.pk in current_tags:
+                tags_to_remove.append(tag_has_errata)
                 if all_rejected:
                     changes.append("removed Errata tag (all errata rejected)")
                 else:
                     changes.append("removed Errata tag")
-            if doc.tags.filter(pk=tag_has_verified_errata.pk):
-                doc.tags.remove(tag_has_verified_errata)
+            if tag_has_verified_errata.pk in current_tags:
+                tags_to_remove.append(tag_has_verified_errata)
                 changes.append("removed Verified Errata tag")
+        # like the relations above, tags are part of the history snapshot
+        if tags_to_add:
+            doc.tags.add(*tags_to_add)
+        if tags_to_remove:
+            doc.tags.remove(*tags_to_remove)
 
         if changes:
             events.append(DocEvent.objects.create(
@@ -553,28 +693,30 @@ def update_docs_from_rfc_index(index_data, errata_data, skip_older_than_date=Non
             yield changes, doc, rfc_published
 
 
+# Shared by all threads posting approved drafts, so that the connection
+# pool is reused.  This is only safe because the session holds no
+# per-request state: it is not modified after import, credentials are
+# passed with each post, and cookies are never stored.
+_rfc_session = requests.Session()
+_rfc_session.headers.update({ "Accept": "text/plain" })
+_rfc_session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+
 def post_approved_draft(url, name):
     """Post an approved draft to the RFC Editor so they can retrieve
     the data from the Datatracker and start processing it. Returns
     response and error (empty string if no error)."""
 
-    # HTTP basic auth
-    username = "dtracksync"
-    password = settings.RFC_EDITOR_SYNC_PASSWORD
-    headers = {
-            "Content-type": "application/x-www-form-urlencoded",
-            "Accept": "text/plain",
-            "Authorization": "Basic %s" % force_str(base64.encodebytes(smart_bytes("%s:%s" % (username, password)))).replace("\n", ""),
-        }
-
     log("Posting RFC-Editor notification of approved draft '%s' to '%s'" % (name, url))
     text = error = ""
 
     try:
-        r = requests.post(
+        # the shared session keeps the connection to the RFC Editor
+        # open between posts; HTTP basic auth is passed per request
+        r = _rfc_session.post(
             url,
-            headers=headers,
-            data=smart_bytes(urlencode({ 'draft': name })),
+            auth=("dtracksync", settings.RFC_EDITOR_SYNC_PASSWORD),
+            data={ 'draft': name },
             timeout=settings.DEFAULT_REQUESTS_TIMEOUT,
         )
 
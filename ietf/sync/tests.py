@@ -6,6 +6,7 @@ import os
 import io
 import json
 import datetime
+import mock
 import quopri
 
 from django.conf import settings
@@ -14,6 +15,7 @@ from django.utils import timezone
 
 import debug                            # pyflakes:ignore
 
+from ietf.api.serializer import model_top_level_cache_key
 from ietf.doc.factories import WgDraftFactory
 from ietf.doc.models import Document, DocAlias, DocEvent, DeletedEvent, DocTagName, RelatedDocument, State, StateDocEvent
 from ietf.doc.utils import add_state_change_event
@@ -321,7 +323,7 @@ class RFCSyncTests(TestCase):
                 "update_date":"2019-09-10 09:09:03"},
         ]
 
-        data = rfceditor.parse_index(io.StringIO(t))
+        data = rfceditor.parse_index(io.BytesIO(t.encode("utf-8")))
         self.assertEqual(len(data), 1)
 
         rfc_number, title, authors, rfc_published_date, current_status, updates, updated_by, obsoletes, obsoleted_by, also, draft, has_errata, stream, wg, file_formats, pages, abstract = data[0]
@@ -376,6 +378,116 @@ class RFCSyncTests(TestCase):
         changed = list(rfceditor.update_docs_from_rfc_index(data, errata, today - datetime.timedelta(days=30)))
         self.assertEqual(len(changed), 0)
 
+    def test_rfc_index_also_three_digit_rfc(self):
+        """Test that BCP/FYI/STD aliases are picked up for RFCs numbered below 1000."""
+        doc = WgDraftFactory(states=[('draft-iesg','rfcqueue')])
+
+        today = date_today()
+
+        t = '''<?xml version="1.0" encoding="UTF-8"?>
+<rfc-index xmlns="http://www.rfc-editor.org/rfc-index">
+    <bcp-entry>
+        <doc-id>BCP0014</doc-id>
+        <is-also>
+            <doc-id>RFC0123</doc-id>
+        </is-also>
+    </bcp-entry>
+    <rfc-entry>
+        <doc-id>RFC0123</doc-id>
+        <title>A Testing RFC</title>
+        <date>
+            <month>%(month)s</month>
+            <year>%(year)s</year>
+        </date>
+        <draft>%(name)s-%(rev)s</draft>
+        <current-status>BEST CURRENT PRACTICE</current-status>
+        <stream>IETF</stream>
+        <wg_acronym>%(group)s</wg_acronym>
+    </rfc-entry>
+</rfc-index>''' % dict(year=today.strftime("%Y"),
+                       month=today.strftime("%B"),
+                       name=doc.name,
+                       rev=doc.rev,
+                       group=doc.group.acronym)
+
+        data = rfceditor.parse_index(io.BytesIO(t.encode("utf-8")))
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0].rfc_number, 123)
+        self.assertEqual(data[0].also, ["BCP14"])
+
+        changes = list(rfceditor.update_docs_from_rfc_index(data, []))
+        self.assertEqual(len(changes), 1)
+        self.assertTrue(DocAlias.objects.filter(name="rfc123", docs=doc))
+        self.assertTrue(DocAlias.objects.filter(name="bcp14", docs=doc))
+
+    def test_rfc_index_relation_to_new_alias(self):
+        """Test that a later index entry can relate to a BCP alias created earlier in the same run."""
+        bcp_doc = WgDraftFactory(states=[('draft-iesg','rfcqueue')])
+        updating_doc = WgDraftFactory(states=[('draft-iesg','rfcqueue')])
+
+        today = date_today()
+
+        t = '''<?xml version="1.0" encoding="UTF-8"?>
+<rfc-index xmlns="http://www.rfc-editor.org/rfc-index">
+    <bcp-entry>
+        <doc-id>BCP0014</doc-id>
+        <is-also>
+            <doc-id>RFC0123</doc-id>
+        </is-also>
+    </bcp-entry>
+    <rfc-entry>
+        <doc-id>RFC0123</doc-id>
+        <title>A Testing RFC</title>
+        <date>
+            <month>%(month)s</month>
+            <year>%(year)s</year>
+        </date>
+        <draft>%(bcp_name)s-%(bcp_rev)s</draft>
+        <current-status>BEST CURRENT PRACTICE</current-status>
+        <stream>IETF</stream>
+        <wg_acronym>%(group)s</wg_acronym>
+    </rfc-entry>
+    <rfc-entry>
+        <doc-id>RFC1234</doc-id>
+        <title>Another Testing RFC</title>
+        <date>
+            <month>%(month)s</month>
+            <year>%(year)s</year>
+        </date>
+        <draft>%(name)s-%(rev)s</draft>
+        <updates>
+            <doc-id>BCP0014</doc-id>
+        </updates>
+        <current-status>PROPOSED STANDARD</current-status>
+        <stream>IETF</stream>
+        <wg_acronym>%(group)s</wg_acronym>
+    </rfc-entry>
+</rfc-index>''' % dict(year=today.strftime("%Y"),
+                       month=today.strftime("%B"),
+                       bcp_name=bcp_doc.name,
+                       bcp_rev=bcp_doc.rev,
+                       name=updating_doc.name,
+                       rev=updating_doc.rev,
+                       group=bcp_doc.group.acronym)
+
+        data = rfceditor.parse_index(io.BytesIO(t.encode("utf-8")))
+        self.assertEqual(len(data), 2)
+
+        updates = rfceditor.update_docs_from_rfc_index(data, [])
+
+        # the alias is in place as soon as the entry listing it is done
+        changes, d, rfc_published = next(updates)
+        self.assertEqual(d, bcp_doc)
+        self.assertIn("created alias BCP 14", changes)
+        self.assertTrue(DocAlias.objects.filter(name="bcp14", docs=bcp_doc))
+
+        changes, d, rfc_published = next(updates)
+        self.assertEqual(d, updating_doc)
+        self.assertIn("created updates relation between %s and BCP 14" % updating_doc.name, changes)
+        self.assertTrue(RelatedDocument.objects.filter(source=updating_doc, target__name="bcp14", relationship="updates"))
+
+        self.assertEqual(list(updates), [])
+
     def _generate_rfc_queue_xml(self, draft, state, auth48_url=None):
         """Generate an RFC queue xml string for a draft"""
         t = '''<rfc-editor-queue xmlns="http://www.rfc-editor.org/rfc-editor-queue">
@@ -416,7 +528,7 @@ class RFCSyncTests(TestCase):
                                          state='EDIT*R*A(1G)',
                                          auth48_url=expected_auth48_url)
 
-        drafts, warnings = rfceditor.parse_queue(io.StringIO(t))
+        drafts, warnings = rfceditor.parse_queue(io.BytesIO(t.encode("utf-8")))
         # rfceditor.parse_queue() is tested independently; just sanity check here
         self.assertEqual(len(drafts), 1)
         self.assertEqual(len(warnings), 0)
@@ -457,7 +569,7 @@ class RFCSyncTests(TestCase):
                                          state='EDIT*R*A(1G)',
                                          auth48_url="http://www.rfc-editor.org/auth48/rfc1234")
 
-        drafts, warnings = rfceditor.parse_queue(io.StringIO(t))
+        drafts, warnings = rfceditor.parse_queue(io.BytesIO(t.encode("utf-8")))
         self.assertEqual(len(drafts), 1)
         self.assertEqual(len(warnings), 0)
 
@@ -473,9 +585,21 @@ class RFCSyncTests(TestCase):
         t = self._generate_rfc_queue_xml(draft,
                                          state='TI',
                                          auth48_url="http://www.rfc-editor.org/auth48/rfc1234")
-        __, warnings = rfceditor.parse_queue(io.StringIO(t))
+        __, warnings = rfceditor.parse_queue(io.BytesIO(t.encode("utf-8")))
         self.assertEqual(len(warnings), 0)
 
+    def test_rfceditor_parse_queue_draft_suffix(self):
+        """Test that only a literal .txt suffix (and revision) is stripped from draft names"""
+        t = '''<rfc-editor-queue xmlns="http://www.rfc-editor.org/rfc-editor-queue">
+<section name="IETF STREAM: WORKING GROUP STANDARDS TRACK">
+<entry><draft>draft-foo-01Xtxt</draft><state>EDIT</state></entry>
+<entry><draft>draft-bar-02.txt.txt</draft><state>EDIT</state></entry>
+</section>
+</rfc-editor-queue>'''
+        drafts, warnings = rfceditor.parse_queue(io.BytesIO(t.encode("utf-8")))
+        self.assertEqual(len(warnings), 0)
+        self.assertEqual([d[0] for d in drafts], ["draft-foo-01Xtxt", "draft-bar"])
+
     def _generate_rfceditor_update(self, draft, state, tags=None, auth48_url=None):
         """Helper to generate fake output from rfceditor.parse_queue()"""
         return [[
@@ -522,6 +646,33 @@ class RFCSyncTests(TestCase):
         auth48_docurl = draft.documenturl_set.filter(tag_id='auth48').first()
         self.assertIsNone(auth48_docurl)
 
+    def test_update_drafts_no_longer_in_queue(self):
+        """Test that the RFC Editor state and tags are removed from drafts that left the queue."""
+        states = [('draft','active'), ('draft-iesg','rfcqueue')]
+        in_queue = WgDraftFactory(states=states)
+        left_queue = WgDraftFactory(states=states)
+        for d in (in_queue, left_queue):
+            d.set_state(State.objects.get(used=True, type="draft-rfceditor", slug="edit"))
+        left_queue.tags.set(DocTagName.objects.filter(slug__in=("iana", "ref", "errata")))
+
+        with mock.patch('ietf.sync.rfceditor.cache.delete_many') as delete_many:
+            changed, warnings = rfceditor.update_drafts_from_queue(
+                self._generate_rfceditor_update(in_queue, state='EDIT')
+            )
+        self.assertEqual(len(warnings), 0)
+        self.assertEqual(changed, set([left_queue.name]))
+        # the cached API data for the cleaned up documents is purged
+        self.assertIn(model_top_level_cache_key(Document), delete_many.call_args[0][0])
+
+        left_queue = Document.objects.get(pk=left_queue.pk)
+        self.assertIsNone(left_queue.get_state("draft-rfceditor"))
+        self.assertEqual(left_queue.get_state_slug("draft"), "active")
+        self.assertEqual(left_queue.get_state_slug("draft-iesg"), "rfcqueue")
+        self.assertEqual(set(left_queue.tags.values_list("slug", flat=True)), set(["errata"]))
+
+        in_queue = Document.objects.get(pk=in_queue.pk)
+        self.assertEqual(in_queue.get_state_slug("draft-rfceditor"), "edit")
+
 
 class DiscrepanciesTests(TestCase):
     def test_discrepancies(self):